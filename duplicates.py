@@ -1,257 +1,669 @@
-#!/usr/bin/python3
-
-__doc__ = """Script for finding duplicated files in a given directory and subdirectories"""
-
-
-import hashlib
-import re
-import os
-import time
-import argparse
-import sys
-from dataclasses import dataclass
-from multiprocessing import Pool, cpu_count
-from datetime import datetime
-
-
-@dataclass
-class FileMetadata:
-    """
-        File basic params.
-    """
-
-    def __init__(self, filepath: str) -> None:
-        self._size = os.path.getsize(filepath)
-        self._mtime = os.path.getmtime(filepath)
-        self._ctime = os.path.getctime(filepath)
-
-    @property
-    def size(self):
-        """file size"""
-        return self._size
-
-    @property
-    def mtime(self):
-        """file modified time"""
-        return self._mtime
-
-    @property
-    def ctime(self):
-        """file created time"""
-        return self._ctime
-
-    def __repr__(self) -> str:
-        format = '%Y-%m-%d %H:%M:%S'
-        return f"FileMetadata: size={self.size/1024:.2f}kb " \
-               f"created={datetime.utcfromtimestamp(self.ctime).strftime(format)} " \
-               f"modified={datetime.utcfromtimestamp(self.mtime).strftime(format)}"
-
-
-@dataclass
-class Item:
-    """
-        Used just to keep together path and file md5 hash.
-    """
-
-    def __init__(self, path: str, md5: str, metadata: FileMetadata):
-        self._path = path
-        self._md5 = md5
-        self._metadata = metadata
-
-    @property
-    def path(self):
-        """path getter"""
-        return self._path
-
-    @property
-    def md5(self):
-        """md5 getter"""
-        return self._md5
-
-    @property
-    def metadata(self):
-        """metadata getter"""
-        return self._metadata
-
-    def __repr__(self):
-        return f"{self.md5} - {self.path}"
-
-
-class FileBrowser:
-    """
-        Class used to find all files in the given directory and subdirectories.
-        For each found file ItemHandler.handle() will be called.
-    """
-
-    def __init__(self, directory_path):
-        self.directory_path = directory_path
-
-    @staticmethod
-    def _handle_item(handler, file_plus_path, filename):
-        handler.handle(file_plus_path, filename)
-
-    def _process_files(self, directory_path, name_regex, handler):
-        try:
-            for file_name in os.listdir(directory_path):
-                file_plus_path = os.path.join(directory_path, file_name)
-                if os.path.isfile(file_plus_path):
-                    if not name_regex:
-                        FileBrowser._handle_item(handler, file_plus_path, file_name)
-                    else:
-                        if name_regex.match(file_name):
-                            FileBrowser._handle_item(handler, file_plus_path, file_name)
-                elif os.path.isdir(file_plus_path):
-                    self._process_files(file_plus_path, name_regex, handler)
-        except PermissionError:
-            print(f"[Error] Permission denied to: {directory_path}")
-
-    def process_files(self, name_regex, handler):
-        """Method to find files and validate input.
-        :param name_regex: regex object to filter file names
-        :param handler: this object will be called if some file will be found
-        """
-        if not isinstance(handler, Handler):
-            raise ValueError(f"handler must be a Handler instance {handler} - {Handler}")
-        if name_regex and not isinstance(name_regex, re.Pattern):
-            raise ValueError(
-                f"nameRegex must be a instance of re.Pattern {name_regex} - {re.Pattern}")
-        self._process_files(self.directory_path, name_regex, handler)
-
-
-class Handler:
-    """Base class used by FileBrowser.process_files()
-       to process results"""
-    def handle(self, path, file_name):
-        """Callback method"""
-        raise NotImplementedError
-
-
-class FileFoundHandler(Handler):
-    """Class used for saving data and calculating md5 hashes"""
-
-    def __init__(self):
-        self._out_list = []
-        self._found_files = []
-        self._cache = None
-
-    @staticmethod
-    def _calculate_md5(path):
-        hash_md5 = hashlib.md5()
-        with open(path, "rb") as file_object:
-            for block in iter(lambda: file_object.read(4096), b''):
-                hash_md5.update(block)
-        return hash_md5.hexdigest()
-
-    @staticmethod
-    def _do_work(path):
-        md5 = FileFoundHandler._calculate_md5(path)
-        metadata = FileMetadata(path)
-        i = Item(path, md5, metadata)
-        return i
-
-    def handle(self, path, file_name):
-        """
-        Callback for each found file
-        :param path: file path
-        :param file_name: file name
-        """
-        self._found_files.append(path)
-        sys.stdout.write(f"Files count: {len(self._found_files)}   \r")
-        sys.stdout.flush()
-
-    def get_files_list(self):
-        """Return gathered data"""
-        if self._cache:
-            return self._cache
-
-        def update_std_out(index, size):
-            sys.stdout.write(f"Progress: {index}/{size}   \r")
-            sys.stdout.flush()
-
-        ready_results = []
-        with Pool(cpu_count()) as pool:
-            workers = []
-            for file_path in self._found_files:
-                workers.append(pool.apply_async(FileFoundHandler._do_work, args=(file_path,)))
-            for i, result in enumerate(workers):
-                ready_results.append(result.get())
-                update_std_out(i, len(workers))
-        self._cache = ready_results
-        return ready_results
-
-
-class Data:
-    """Class for managing data gathered data"""
-
-    def __init__(self):
-        self._items = []
-
-    def check_dir(self, path, name_reg=None):
-        """
-        Get files list
-        :param path: root path
-        :param name_reg: file name filter
-        :return: files list
-        """
-        file_browser_object = FileBrowser(path)
-        item_handler_object = FileFoundHandler()
-
-        print("Indexing...")
-        file_browser_object.process_files(name_reg, item_handler_object)
-        print("Calculating md5...")
-        self._items = item_handler_object.get_files_list()
-        return self._items
-
-    def check_for_duplicates(self, delete=None, files_list=None):
-        """
-        Search for duplicated files
-        :param delete: if not none duplicated files will be deleted
-        :param files_list: custom files list, if none cached list will be used
-        """
-        print("Duplicate searching...")
-        count = 0
-        wasted_space = 0
-        files_list = files_list or self._items
-        data_sorted = sorted(files_list, key=lambda item: item.md5)
-        for i, item_at_i in enumerate(data_sorted):
-            if i > 0 and item_at_i.md5 == data_sorted[i - 1].md5:
-                count += 1
-                wasted_space += item_at_i.metadata.size
-                print(f"{count}. Duplicate found! "
-                      f"[{item_at_i.metadata}] "
-                      f"\n\t[{str(data_sorted[i - 1].path)} - {str(item_at_i.path)}]")
-                if delete:
-                    print(f"Deleting {item_at_i.path}")
-                    os.remove(item_at_i.path)
-        print(f"\nSummary:\n\tduplicates={count}\n\twasted space={wasted_space/1024:.2f}kb\n")
-
-
-def main():
-    """Entry function"""
-    parser = argparse.ArgumentParser(description='Check duplicates in given folder and subfolders.')
-    parser.add_argument('-r', '--root',
-                        help='starting directory for the script',
-                        default=os.getcwd(),
-                        required=False)
-    parser.add_argument('-data_object', '--delete',
-                        action='store_true',
-                        help="delete duplicates",
-                        required=False)
-    args = parser.parse_args()
-
-    print(f"[root={args.root}, delete={str(args.delete)}]")
-
-    time_start = time.time()
-    try:
-        data_object = Data()
-        data_object.check_dir(args.root, None)
-        data_object.check_for_duplicates(args.delete)
-    except KeyboardInterrupt:
-        print("Interrupted!")
-    finally:
-        time_elapsed = time.time() - time_start
-    print(f"Done, took={time_elapsed:.2f} seconds")
-
-
-if __name__ == "__main__":
-    main()
+#!/usr/bin/python3
+
+__doc__ = """Script for finding duplicated files in a given directory and subdirectories"""
+
+
+import hashlib
+import re
+import os
+import time
+import argparse
+import sys
+import queue
+import threading
+import sqlite3
+from collections import defaultdict
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+from datetime import datetime
+from functools import partial
+from itertools import chain
+from typing import Any, Iterator, Optional, Protocol, Tuple, Union
+
+try:
+    # linear time DFA based matching, optional
+    import re2  # type: ignore
+except ImportError:
+    re2 = None
+
+
+# files up to this size are hashed whole at once, bigger ones get head+tail quick hash first
+SMALL_FILE_SIZE = 128 * 1024
+QUICK_HASH_BLOCK = 4 * 1024
+READ_BLOCK_SIZE = 1024 * 1024
+# sha256 is computed in hardware on CPUs with SHA extensions (x86 SHA-NI, ARMv8)
+DEFAULT_ALGORITHM = "sha256"
+# hashlib releases the GIL while hashing, threads are enough for the I/O bound workload
+THREAD_WORKERS = min(32, cpu_count() * 4)
+SCAN_WORKERS = THREAD_WORKERS
+# number of files handed to a hashing worker at once while the scan is still running
+STREAM_CHUNK_SIZE = 16
+PROGRESS_INTERVAL = 0.2
+DELETE_WORKERS = 16
+# bump when format of stored digests changes, old cache content is dropped then
+DIGEST_CACHE_VERSION = 3
+DEFAULT_CACHE_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "duplicates", "digests.sqlite")
+
+
+class Progress:
+    """
+        Status line printer, prints at most once per PROGRESS_INTERVAL seconds
+        and only when stdout is a terminal.
+    """
+
+    def __init__(self):
+        self._enabled = sys.stdout.isatty()
+        self._last_print = 0.0
+
+    def update(self, message):
+        """Print message over the previous one, if it is time for it"""
+        if not self._enabled:
+            return
+        now = time.monotonic()
+        if now - self._last_print < PROGRESS_INTERVAL:
+            return
+        self._last_print = now
+        sys.stdout.write(f"{message}   \r")
+        sys.stdout.flush()
+
+
+class NamePattern(Protocol):
+    """Compiled file name filter, re.Pattern or a re2 pattern"""
+
+    def match(self, string: str) -> Any:
+        """Match the beginning of string, falsy result means no match"""
+
+
+class FileMetadata:
+    """
+        File basic params: size, mtime (modified time) and ctime (created time).
+    """
+
+    __slots__ = ("size", "mtime", "ctime")
+
+    def __init__(self, filepath: Optional[str] = None,
+                 st: Optional[os.stat_result] = None) -> None:
+        if st is None:
+            if filepath is None:
+                raise ValueError("filepath or st must be given")
+            st = os.stat(filepath)
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.ctime = st.st_ctime
+
+    def __repr__(self) -> str:
+        format = '%Y-%m-%d %H:%M:%S'
+        return f"FileMetadata: size={self.size/1024:.2f}kb " \
+               f"created={datetime.utcfromtimestamp(self.ctime).strftime(format)} " \
+               f"modified={datetime.utcfromtimestamp(self.mtime).strftime(format)}"
+
+
+class Item:
+    """
+        Used just to keep together path and file content hash.
+        Aliases are other hardlinks to the same file.
+    """
+
+    __slots__ = ("path", "digest", "metadata", "aliases")
+
+    def __init__(self, path: str, digest: bytes, metadata: FileMetadata, aliases=None):
+        self.path = path
+        self.digest = digest
+        self.metadata = metadata
+        self.aliases = aliases or []
+
+    def __repr__(self):
+        return f"{self.digest.hex()} - {self.path}"
+
+
+class FileBrowser:
+    """
+        Class used to find all files in the given directory and subdirectories.
+        Found files are yielded as soon as they are discovered.
+        Symbolic links are not followed.
+    """
+
+    def __init__(self, directory_path: str) -> None:
+        self.directory_path = directory_path
+
+    @staticmethod
+    def _scan_directory(directory_path: str, name_regex: Optional[NamePattern],
+                        directories: "queue.Queue[Optional[str]]",
+                        found: "queue.Queue[Union[os.DirEntry[str], Exception, None]]") -> None:
+        try:
+            entries = os.scandir(directory_path)
+        except PermissionError:
+            print(f"[Error] Permission denied to: {directory_path}")
+            return
+        except OSError as error:
+            print(f"[Error] Can not read: {directory_path} - {error}")
+            return
+        with entries:
+            for entry in entries:
+                try:
+                    # DirEntry type checks need no stat() call
+                    if entry.is_file(follow_symlinks=False):
+                        if not name_regex or name_regex.match(entry.name):
+                            # stat() result is cached by the entry, let it overlap as well
+                            entry.stat()
+                            found.put(entry)
+                    elif entry.is_dir(follow_symlinks=False):
+                        directories.put(entry.path)
+                except OSError as error:
+                    # entry removed or unreadable since readdir, the rest is still scanned
+                    print(f"[Error] Can not read: {entry.path} - {error}")
+
+    @staticmethod
+    def _process_files(directory_path: str,
+                       name_regex: Optional[NamePattern]) -> Iterator[Tuple[str, os.stat_result]]:
+        # directories are scanned by a pool of threads so readdir/stat latencies overlap,
+        # found files are yielded in the consuming thread
+        directories: "queue.Queue[Optional[str]]" = queue.Queue()
+        found: "queue.Queue[Union[os.DirEntry[str], Exception, None]]" = queue.Queue()
+
+        def worker() -> None:
+            try:
+                for current_path in iter(directories.get, None):
+                    try:
+                        FileBrowser._scan_directory(current_path, name_regex, directories, found)
+                    finally:
+                        directories.task_done()
+            except Exception as error:
+                # re-raised by the consumer, otherwise the file list would silently be partial
+                found.put(error)
+            finally:
+                found.put(None)
+
+        def stop_workers() -> None:
+            directories.join()
+            for _ in range(SCAN_WORKERS):
+                directories.put(None)
+
+        directories.put(directory_path)
+        for _ in range(SCAN_WORKERS):
+            threading.Thread(target=worker, daemon=True).start()
+        threading.Thread(target=stop_workers, daemon=True).start()
+
+        running = SCAN_WORKERS
+        while running:
+            entry = found.get()
+            if entry is None:
+                running -= 1
+            elif isinstance(entry, Exception):
+                raise entry
+            else:
+                yield entry.path, entry.stat()
+
+    def process_files(self,
+                      name_regex: Optional[NamePattern]) -> Iterator[Tuple[str, os.stat_result]]:
+        """Method to find files and validate input.
+        :param name_regex: compiled regex (re or re2) to filter file names
+        :return: generator of (path, os.stat_result) tuples of found files
+        """
+        if name_regex and not callable(getattr(name_regex, "match", None)):
+            raise ValueError(
+                f"nameRegex must be a compiled regex with match() method {name_regex}")
+        return self._process_files(self.directory_path, name_regex)
+
+
+class _Re2Pattern:
+    """
+        re2 pattern, names which are not valid UTF-8 (surrogate escaped by os.scandir)
+        can not be passed to re2 and are matched with re instead.
+    """
+
+    __slots__ = ("_pattern", "_fallback")
+
+    def __init__(self, pattern: str) -> None:
+        self._pattern = re2.compile(pattern)
+        self._fallback = re.compile(pattern)
+
+    def match(self, string: str) -> Any:
+        """Match the beginning of string"""
+        try:
+            return self._pattern.match(string)
+        except UnicodeEncodeError:
+            return self._fallback.match(string)
+
+
+def compile_name_regex(pattern: str) -> NamePattern:
+    """
+    Compile file name filter, with re2 if it is installed
+    :param pattern: regular expression matched against file names
+    :return: compiled pattern
+    """
+    if re2:
+        try:
+            return _Re2Pattern(pattern)
+        except re2.error:
+            # re2 does not support all of re syntax, e.g. backreferences
+            pass
+    return re.compile(pattern)
+
+
+_thread_data = threading.local()
+
+
+def _read_buffer() -> Tuple[bytearray, memoryview]:
+    """Read buffer allocated once per worker thread (or process)"""
+    if not hasattr(_thread_data, "buffer"):
+        _thread_data.buffer = bytearray(READ_BLOCK_SIZE)
+        _thread_data.view = memoryview(_thread_data.buffer)
+    return _thread_data.buffer, _thread_data.view
+
+
+def _calculate_quick_digest(path: str, size: int, algo: str = DEFAULT_ALGORITHM) -> bytes:
+    """Digest of a whole small file, or of first and last QUICK_HASH_BLOCK bytes of a big one"""
+    with open(path, "rb") as file_object:
+        if size <= SMALL_FILE_SIZE:
+            return hashlib.new(algo, file_object.read()).digest()
+        hash_object = hashlib.new(algo, file_object.read(QUICK_HASH_BLOCK))
+        # the file might have shrunk since it was scanned
+        current_size = os.fstat(file_object.fileno()).st_size
+        file_object.seek(max(0, current_size - QUICK_HASH_BLOCK))
+        hash_object.update(file_object.read(QUICK_HASH_BLOCK))
+    return hash_object.digest()
+
+
+def _calculate_digest(path: str, algo: str = DEFAULT_ALGORITHM) -> bytes:
+    with open(path, "rb", buffering=0) as file_object:
+        if hasattr(os, "posix_fadvise"):
+            # let the kernel read ahead while the current block is being hashed
+            os.posix_fadvise(file_object.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(file_object.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        hash_object = hashlib.new(algo)
+        buffer, view = _read_buffer()
+        while True:
+            size = file_object.readinto(buffer)
+            if not size:
+                break
+            hash_object.update(view[:size])
+    # raw digest is half the size of the hex one, it is formatted only for printing
+    return hash_object.digest()
+
+
+def _do_quick_work(file_info: Tuple[str, int], algo: str) -> Tuple[str, Optional[bytes]]:
+    path, size = file_info
+    try:
+        return path, _calculate_quick_digest(path, size, algo)
+    except OSError as error:
+        print(f"[Error] Can not read: {path} - {error}")
+        return path, None
+
+
+def _do_work(path: str, algo: str) -> Tuple[str, Optional[bytes]]:
+    try:
+        return path, _calculate_digest(path, algo)
+    except OSError as error:
+        print(f"[Error] Can not read: {path} - {error}")
+        return path, None
+
+
+def _remove_file(path: str) -> Tuple[str, Optional[OSError]]:
+    try:
+        os.remove(path)
+    except OSError as error:
+        return path, error
+    return path, None
+
+
+class DigestCache:
+    """
+        Digests of already hashed files stored in a sqlite database.
+        Both quick and full digests are kept, any of them might be missing.
+        Paths are stored absolute, so runs from different working directories do not mix.
+        A cached digest is valid as long as the file is the same inode (st_dev, st_ino)
+        with unchanged size, mtime and ctime.
+    """
+
+    def __init__(self, path, algorithm=DEFAULT_ALGORITHM):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # lookups are done by the pool thread consuming the scan, never concurrently
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+            if version != DIGEST_CACHE_VERSION:
+                self._connection.execute("DROP TABLE IF EXISTS digests")
+                self._connection.execute(f"PRAGMA user_version = {DIGEST_CACHE_VERSION}")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS digests ("
+                "path TEXT, algorithm TEXT, size INTEGER, mtime_ns INTEGER, "
+                "ctime_ns INTEGER, dev INTEGER, ino INTEGER, "
+                "quick_digest BLOB, digest BLOB, "
+                "PRIMARY KEY (path, algorithm))")
+        self._algorithm = algorithm
+        self._pending = []
+
+    def _key(self, path, st):
+        return (os.path.abspath(path), self._algorithm, st.st_size, st.st_mtime_ns,
+                st.st_ctime_ns, st.st_dev, st.st_ino)
+
+    def get(self, path, st):
+        """
+        Get cached digests
+        :param path: file path
+        :param st: current os.stat_result of the file
+        :return: (quick digest, digest) tuple, None for values not cached or if file was modified
+        """
+        row = self._connection.execute(
+            "SELECT quick_digest, digest FROM digests "
+            "WHERE path = ? AND algorithm = ? AND size = ? AND mtime_ns = ? "
+            "AND ctime_ns = ? AND dev = ? AND ino = ?",
+            self._key(path, st)).fetchone()
+        return row if row else (None, None)
+
+    def put(self, path, st, quick_digest, digest):
+        """Queue digests to be stored by save()"""
+        self._pending.append(self._key(path, st) + (quick_digest, digest))
+
+    def save(self):
+        """Store all queued digests in one transaction"""
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", self._pending)
+        self._pending = []
+
+    def close(self):
+        """Close database connection"""
+        self._connection.close()
+
+
+class FileFoundHandler:
+    """Class used for calculating content hashes of found files"""
+
+    def __init__(self, algorithm=DEFAULT_ALGORITHM, use_processes=False, digest_cache=None):
+        self._out_list = []
+        self._cache = None
+        self._algorithm = algorithm
+        self._use_processes = use_processes
+        self._digest_cache = digest_cache
+
+    def _create_pool(self):
+        if self._use_processes:
+            return Pool(cpu_count())
+        return ThreadPool(THREAD_WORKERS)
+
+    def _candidates(self, files, path_to_stat, path_to_aliases, known_quick, cached_digests):
+        """
+        Filter streamed files down to those sharing size with another file,
+        hardlinks to an already found file are recorded as its aliases and skipped
+        :param files: iterable of (path, os.stat_result) tuples
+        :param path_to_stat: filled with stats of all candidates
+        :param path_to_aliases: filled with path: other hardlinks to the same file
+        :param known_quick: filled with (path, quick digest) of candidates found in the cache
+                            or empty
+        :param cached_digests: filled with path: digest of candidates found in the cache
+        :return: generator of (path, size) of candidates which have to be quick hashed
+        """
+        # first file of each size is kept back until another file of that size shows up
+        size_to_first = {}
+        inode_to_path = {}
+        empty_digest = hashlib.new(self._algorithm).digest()
+        progress = Progress()
+        for count, (path, st) in enumerate(files, 1):
+            progress.update(f"Files count: {count}")
+            if st.st_nlink > 1:
+                inode = (st.st_dev, st.st_ino)
+                if inode in inode_to_path:
+                    path_to_aliases[inode_to_path[inode]].append(path)
+                    continue
+                inode_to_path[inode] = path
+            size = st.st_size
+            if size not in size_to_first:
+                size_to_first[size] = (path, st)
+                continue
+            pending = [(path, st)]
+            if size_to_first[size]:
+                pending.insert(0, size_to_first[size])
+                size_to_first[size] = None
+            for candidate_path, candidate_st in pending:
+                path_to_stat[candidate_path] = candidate_st
+                if not size:
+                    known_quick.append((candidate_path, empty_digest))
+                    continue
+                quick_digest, digest = self._digest_cache.get(candidate_path, candidate_st) \
+                    if self._digest_cache else (None, None)
+                if digest:
+                    cached_digests[candidate_path] = digest
+                if quick_digest:
+                    known_quick.append((candidate_path, quick_digest))
+                else:
+                    yield candidate_path, size
+
+    def get_files_list(self, files=None):
+        """
+        Return gathered data, only files which might have a duplicate are hashed.
+        Files are grouped by size first, then by hash of their first and last QUICK_HASH_BLOCK
+        bytes and only files colliding on both are fully hashed.
+        Hashing starts while files are still being discovered.
+        Digests found in the digest cache are not calculated again,
+        empty files and extra hardlinks of a file are never read.
+        :param files: iterable of (path, os.stat_result) tuples, e.g. FileBrowser.process_files()
+        """
+        if self._cache:
+            return self._cache
+
+        path_to_stat = {}
+        path_to_aliases = defaultdict(list)
+        known_quick = []
+        cached_digests = {}
+        candidates = self._candidates(files or [], path_to_stat, path_to_aliases,
+                                      known_quick, cached_digests)
+
+        quick_hashes = []
+        calculated = []
+        try:
+            digests = self._hash(candidates, path_to_stat, known_quick, cached_digests,
+                                 quick_hashes, calculated)
+        finally:
+            # digests calculated so far are kept even if the run was interrupted
+            if self._digest_cache:
+                path_to_quick = dict(chain(quick_hashes, known_quick))
+                path_to_digest = dict(calculated)
+                for path in {path for path, _ in quick_hashes} | path_to_digest.keys():
+                    self._digest_cache.put(path, path_to_stat[path],
+                                           path_to_quick.get(path), path_to_digest.get(path))
+                self._digest_cache.save()
+        ready_results = []
+        for path, digest in digests:
+            # the smallest link represents a hardlinked file, not the one scanned first
+            links = sorted([path] + path_to_aliases.get(path, []))
+            ready_results.append(
+                Item(links[0], digest, FileMetadata(st=path_to_stat[path]), links[1:]))
+        self._cache = ready_results
+        return ready_results
+
+    def _hash(self, candidates, path_to_stat, known_quick, cached_digests,
+              quick_hashes, calculated):
+        """
+        Quick hash candidates and fully hash those colliding on size and quick digest,
+        files which could not be read are left out
+        :param quick_hashes: filled with (path, quick digest) of hashed candidates
+        :param calculated: filled with (path, digest) of fully hashed files
+        :return: list of (path, digest) of files which might have a duplicate
+        """
+        with self._create_pool() as pool:
+            # pool pulls candidates lazily, so hashing overlaps with the directory scan
+            for path, quick_digest in pool.imap_unordered(
+                    partial(_do_quick_work, algo=self._algorithm),
+                    candidates, chunksize=STREAM_CHUNK_SIZE):
+                if quick_digest is not None:
+                    quick_hashes.append((path, quick_digest))
+
+            quick_to_paths = defaultdict(list)
+            # cached quick digests are complete once all candidates were consumed
+            for path, quick_digest in chain(quick_hashes, known_quick):
+                quick_to_paths[(path_to_stat[path].st_size, quick_digest)].append(path)
+
+            digests = []
+            work = []
+            for (size, quick_digest), paths in quick_to_paths.items():
+                if len(paths) < 2:
+                    continue
+                for path in paths:
+                    if size <= SMALL_FILE_SIZE:
+                        # the quick hash already covers the whole content of small files
+                        digests.append((path, quick_digest))
+                    elif path in cached_digests:
+                        digests.append((path, cached_digests[path]))
+                    else:
+                        work.append(path)
+            # every file left is bigger than SMALL_FILE_SIZE, batching them would only let
+            # a few huge files stall a single worker, so one path per task
+            progress = Progress()
+            for i, (path, digest) in enumerate(pool.imap_unordered(
+                    partial(_do_work, algo=self._algorithm), work, chunksize=1)):
+                progress.update(f"Progress: {i}/{len(work)}")
+                if digest is not None:
+                    calculated.append((path, digest))
+            digests.extend(calculated)
+        return digests
+
+
+class Data:
+    """Class for managing data gathered data"""
+
+    def __init__(self):
+        self._items = []
+
+    def check_dir(self, path, name_reg=None, algorithm=DEFAULT_ALGORITHM, use_processes=False,
+                  cache_path=None):
+        """
+        Get files list
+        :param path: root path
+        :param name_reg: file name filter
+        :param algorithm: hashlib algorithm used to fingerprint file content
+        :param use_processes: hash in a process pool instead of a thread pool
+        :param cache_path: sqlite file with digests from previous runs, if none cache is disabled
+        :return: files list
+        """
+        digest_cache = None
+        if cache_path:
+            try:
+                digest_cache = DigestCache(cache_path, algorithm)
+            except (OSError, sqlite3.Error) as error:
+                print(f"[Error] Can not open digest cache: {cache_path} - {error}")
+
+        file_browser_object = FileBrowser(path)
+        item_handler_object = FileFoundHandler(algorithm, use_processes, digest_cache)
+
+        try:
+            print(f"Indexing and calculating {algorithm}...")
+            self._items = item_handler_object.get_files_list(
+                file_browser_object.process_files(name_reg))
+        finally:
+            if digest_cache:
+                digest_cache.close()
+        return self._items
+
+    @staticmethod
+    def _delete_files(paths):
+        """
+        Delete files in a pool of threads, so unlink calls are in flight concurrently
+        :param paths: paths of files to delete
+        """
+        with ThreadPool(DELETE_WORKERS) as pool:
+            for path, error in pool.imap_unordered(_remove_file, paths):
+                if error:
+                    print(f"[Error] Can not delete: {path} - {error}")
+                else:
+                    print(f"Deleted {path}")
+
+    def check_for_duplicates(self, delete=None, files_list=None):
+        """
+        Search for duplicated files
+        :param delete: if not none duplicated files will be deleted
+        :param files_list: custom files list, if none cached list will be used
+        """
+        print("Duplicate searching...")
+        count = 0
+        wasted_space = 0
+        files_list = files_list or self._items
+        groups = defaultdict(list)
+        for item in files_list:
+            groups[(item.metadata.size, item.digest)].append(item)
+        # only duplicates are sorted, files are hashed in completion order so without it
+        # output and the kept original of each group would change between runs,
+        # the file with most hardlinks is kept as the original
+        duplicate_groups = sorted(
+            (sorted(items, key=lambda item: (-len(item.aliases), item.path))
+             for items in groups.values() if len(items) > 1),
+            key=lambda items: items[0].path)
+        to_delete = []
+        for items in duplicate_groups:
+            original = items[0]
+            for item in items[1:]:
+                count += 1
+                wasted_space += item.metadata.size
+                print(f"{count}. Duplicate found! "
+                      f"[{item.metadata}] "
+                      f"\n\t[{str(original.path)} - {str(item.path)}]")
+                if item.aliases:
+                    print(f"\tHardlinks of {item.path}: {', '.join(item.aliases)}")
+                if delete:
+                    # space is freed only when all links to the file are removed
+                    to_delete.append(item.path)
+                    to_delete.extend(item.aliases)
+        if to_delete:
+            self._delete_files(to_delete)
+        print(f"\nSummary:\n\tduplicates={count}\n\twasted space={wasted_space/1024:.2f}kb\n")
+
+
+def main():
+    """Entry function"""
+    parser = argparse.ArgumentParser(description='Check duplicates in given folder and subfolders.')
+    parser.add_argument('-r', '--root',
+                        help='starting directory for the script',
+                        default=os.getcwd(),
+                        required=False)
+    parser.add_argument('-data_object', '--delete',
+                        action='store_true',
+                        help="delete duplicates",
+                        required=False)
+    parser.add_argument('-a', '--algorithm',
+                        help=f"hash algorithm used to compare files, default {DEFAULT_ALGORITHM}",
+                        choices=sorted(name for name in hashlib.algorithms_guaranteed
+                                       if not name.startswith('shake')),
+                        default=DEFAULT_ALGORITHM,
+                        required=False)
+    parser.add_argument('-p', '--processes',
+                        action='store_true',
+                        help="hash in separate processes, faster only when files are already cached "
+                             "in memory and hashing is CPU bound",
+                        required=False)
+    parser.add_argument('-c', '--cache',
+                        help=f"digest cache file, default {DEFAULT_CACHE_PATH}",
+                        default=DEFAULT_CACHE_PATH,
+                        required=False)
+    parser.add_argument('--no-cache',
+                        action='store_true',
+                        help="do not use digests calculated in previous runs",
+                        required=False)
+    parser.add_argument('-n', '--name',
+                        help="regular expression, only files with matching names are checked",
+                        default=None,
+                        required=False)
+    args = parser.parse_args()
+
+    print(f"[root={args.root}, delete={str(args.delete)}, algorithm={args.algorithm}]")
+
+    time_start = time.time()
+    try:
+        data_object = Data()
+        name_reg = compile_name_regex(args.name) if args.name else None
+        data_object.check_dir(args.root, name_reg, args.algorithm, args.processes,
+                              None if args.no_cache else args.cache)
+        data_object.check_for_duplicates(args.delete)
+    except KeyboardInterrupt:
+        print("Interrupted!")
+    finally:
+        time_elapsed = time.time() - time_start
+    print(f"Done, took={time_elapsed:.2f} seconds")
+
+
+if __name__ == "__main__":
+    main()